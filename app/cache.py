@@ -0,0 +1,187 @@
+"""
+Cache Module for User Documents
+
+This module provides the caches used by the Storage class to avoid a MongoDB
+round-trip for every authenticated request: a small in-process cache, and a
+Redis-backed one shared by every worker when REDIS_URL is configured.
+"""
+
+from collections import OrderedDict
+from threading import Lock
+import time
+from typing import Any, Callable, Optional
+from bson import json_util
+
+
+class UserCache:
+    """Thread-safe LRU cache whose entries expire after a fixed TTL."""
+
+    def __init__(self, maxsize: int = 10_000, ttl: float = 30):
+        """
+        Initialize the cache.
+
+        Args:
+            maxsize: Maximum number of entries before the least recently
+                used one is evicted
+            ttl: Seconds an entry stays valid after it was stored
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key: str) -> Optional[Any]:
+        """
+        Get a cached value.
+
+        Args:
+            key: The cache key
+
+        Returns:
+            The cached value, or None if it is missing or expired
+        """
+        with self._lock:
+            return self._get(key)
+
+    def set(self, key: str, value: Any):
+        """
+        Store a value, evicting the least recently used entry if full.
+
+        Args:
+            key: The cache key
+            value: The value to cache
+        """
+        with self._lock:
+            self._set(key, value)
+
+    def update(self, key: str, func: Callable[[Optional[Any]], Optional[Any]]):
+        """
+        Atomically replace a value with one computed from the current value.
+
+        Args:
+            key: The cache key
+            func: Called with the current value (or None); returns the new
+                value, or None to leave the cache untouched
+        """
+        with self._lock:
+            value = func(self._get(key))
+            if value is not None:
+                self._set(key, value)
+
+    def pop(self, key: str):
+        """
+        Remove a value from the cache if present.
+
+        Args:
+            key: The cache key
+        """
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        """Remove every value from the cache."""
+        with self._lock:
+            self._data.clear()
+
+    def _get(self, key: str) -> Optional[Any]:
+        """Get a cached value; the caller must hold the lock."""
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._data[key]
+            return None
+
+        self._data.move_to_end(key)
+        return value
+
+    def _set(self, key: str, value: Any):
+        """Store a value; the caller must hold the lock."""
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        if len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+
+class RedisUserCache:
+    """User cache stored in Redis, with the same interface as UserCache."""
+
+    def __init__(self, client, ttl: int = 30, prefix: str = "user:"):
+        """
+        Initialize the cache.
+
+        Args:
+            client: A redis.Redis client
+            ttl: Seconds an entry stays valid after it was stored
+            prefix: Prefix added to every key stored in Redis
+        """
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def get(self, key: str) -> Optional[Any]:
+        """
+        Get a cached value.
+
+        Args:
+            key: The cache key
+
+        Returns:
+            The cached value, or None if it is missing or expired
+        """
+        data = self.client.get(self.prefix + key)
+        if data is None:
+            return None
+        return json_util.loads(data)
+
+    def set(self, key: str, value: Any):
+        """
+        Store a value with the configured TTL.
+
+        Args:
+            key: The cache key
+            value: The value to cache
+        """
+        self.client.setex(self.prefix + key, self.ttl, json_util.dumps(value))
+
+    def update(self, key: str, func: Callable[[Optional[Any]], Optional[Any]]):
+        """
+        Atomically replace a value with one computed from the current value.
+
+        Uses WATCH/MULTI, retrying if another client changes the key first.
+
+        Args:
+            key: The cache key
+            func: Called with the current value (or None); returns the new
+                value, or None to leave the cache untouched
+        """
+        from redis.exceptions import WatchError
+
+        name = self.prefix + key
+        with self.client.pipeline() as pipe:
+            while True:
+                try:
+                    pipe.watch(name)
+                    data = pipe.get(name)
+                    value = func(None if data is None else json_util.loads(data))
+                    if value is None:
+                        pipe.unwatch()
+                        return
+
+                    pipe.multi()
+                    pipe.setex(name, self.ttl, json_util.dumps(value))
+                    pipe.execute()
+                    return
+                except WatchError:
+                    continue
+
+    def pop(self, key: str):
+        """
+        Remove a value from the cache if present.
+
+        Args:
+            key: The cache key
+        """
+        self.client.delete(self.prefix + key)
@@ -0,0 +1,91 @@
+"""
+Password Hashing Module
+
+This module wraps the password hashing primitives used by the storage layer,
+so the hashing backend can be changed without touching the Storage class.
+
+New passwords are hashed with Argon2id. Hashes created before the switch are
+bcrypt hashes stored as bytes; they still verify, and needs_rehash() reports
+them so they can be upgraded on the next successful login.
+
+Hashing runs on a bounded thread pool. Both the argon2 and bcrypt extensions
+release the GIL, so request threads waiting on a hash do not block the rest
+of the app. Each Argon2 hash already spreads over several lanes (threads) and
+64 MiB of memory, so the pool only runs one hash per group of that many
+cores; a burst of logins queues up instead of oversubscribing the cores and
+memory that cheaper routes need.
+"""
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Union
+
+import bcrypt
+from argon2 import PasswordHasher
+from argon2.exceptions import InvalidHashError, VerificationError
+
+# RFC 9106 low-memory profile: 3 passes over 64 MiB with 4 lanes
+_HASHER = PasswordHasher(time_cost=3, memory_cost=64 * 1024, parallelism=4)
+
+_HASH_POOL = ThreadPoolExecutor(
+    max_workers=max(1, (os.cpu_count() or 1) // _HASHER.parallelism),
+    thread_name_prefix="hashpw",
+)
+
+
+def _is_bcrypt(stored_hash: Union[str, bytes]) -> bool:
+    """Check whether a stored hash is a legacy bcrypt hash."""
+    return isinstance(stored_hash, bytes)
+
+
+def hash_password(password: str) -> str:
+    """
+    Hash a password with a freshly generated salt.
+
+    Args:
+        password: The plain text password
+
+    Returns:
+        The Argon2id hash in PHC string format ($argon2id$...)
+    """
+    return _HASH_POOL.submit(_HASHER.hash, password).result()
+
+
+def verify_password(password: str, stored_hash: Union[str, bytes]) -> bool:
+    """
+    Check a password against a stored hash.
+
+    Args:
+        password: The plain text password
+        stored_hash: The stored Argon2id hash, or a legacy bcrypt hash
+
+    Returns:
+        True if the password matches the hash, False otherwise
+    """
+    if _is_bcrypt(stored_hash):
+        try:
+            return _HASH_POOL.submit(
+                bcrypt.checkpw, password.encode("utf-8"), stored_hash
+            ).result()
+        except ValueError:
+            # bcrypt rejects passwords longer than 72 bytes
+            return False
+
+    try:
+        return _HASH_POOL.submit(_HASHER.verify, stored_hash, password).result()
+    except (VerificationError, InvalidHashError):
+        return False
+
+
+def needs_rehash(stored_hash: Union[str, bytes]) -> bool:
+    """
+    Check whether a stored hash should be replaced with a fresh one.
+
+    Args:
+        stored_hash: The stored Argon2id hash, or a legacy bcrypt hash
+
+    Returns:
+        True for legacy bcrypt hashes and Argon2id hashes made with
+        outdated parameters, False otherwise
+    """
+    return _is_bcrypt(stored_hash) or _HASHER.check_needs_rehash(stored_hash)
@@ -5,17 +5,90 @@ This module provides a Storage class for managing user data and todo tasks
 in MongoDB database.
 """
 
+from pymongo import ReturnDocument
 from pymongo.mongo_client import MongoClient
 from pymongo.server_api import ServerApi
-from pymongo.errors import ConnectionFailure, DuplicateKeyError
+from pymongo.errors import (
+    ConnectionFailure,
+    DuplicateKeyError,
+    OperationFailure,
+    PyMongoError,
+)
 import os
+import threading
+import time
 from dotenv import load_dotenv
-import bcrypt
 from datetime import datetime
-from typing import List, Dict
+import math
+from typing import Callable, List, Dict, Optional
+from app import crypto
+from app.cache import UserCache, RedisUserCache
 
 load_dotenv()
 
+# Server-side task counts, added to every projection that gets cached
+COUNTS_PROJECTION = {
+    "todo_count": {"$size": {"$ifNull": ["$todos", []]}},
+    "completed_count": {"$size": {"$ifNull": ["$completed", []]}},
+}
+
+# Number of tasks per list shown on each page of the main page
+PAGE_SIZE = 50
+
+# Most projections (pages, full lists) cached per user at once
+MAX_CACHED_VIEWS = 5
+
+
+def page_key(page: int, page_size: int) -> str:
+    """Name of a page's projection within a user's cache entry."""
+    return f"page:{page}:{page_size}"
+
+
+def merge_view(entry: Optional[Dict], key: str, view: Dict) -> Optional[Dict]:
+    """
+    Fold a freshly fetched projection into a user's cache entry.
+
+    Every projection in an entry shares the same updated_at. A view of the
+    same version is added next to them (dropping the oldest beyond
+    MAX_CACHED_VIEWS), a newer view replaces the entry, and an older one,
+    fetched before a write that has already refreshed the cache, is dropped.
+
+    Args:
+        entry: The user's current cache entry, or None
+        key: Name of the projection within the entry
+        view: The fetched projection
+
+    Returns:
+        The new cache entry, or None to keep the current one
+    """
+    if not entry:
+        return {key: view}
+
+    cached_at = next(iter(entry.values())).get("updated_at") or datetime.min
+    fetched_at = view.get("updated_at") or datetime.min
+    if cached_at > fetched_at:
+        return None
+    if cached_at < fetched_at:
+        return {key: view}
+
+    merged = {name: cached for name, cached in entry.items() if name != key}
+    merged[key] = view
+    while len(merged) > MAX_CACHED_VIEWS:
+        del merged[next(iter(merged))]
+    return merged
+
+
+def page_projection(page: int, page_size: int) -> Dict:
+    """Projection fetching one page of both task lists and their totals."""
+    skip = page * page_size
+    return {
+        "todos": {"$slice": [skip, page_size]},
+        "completed": {"$slice": [skip, page_size]},
+        "updated_at": 1,
+        "_id": 0,
+        **COUNTS_PROJECTION,
+    }
+
 
 class Storage:
     """Storage class for MongoDB operations related to users and tasks."""
@@ -27,8 +100,23 @@ class Storage:
         self.db = None
         self.users_collection = None
         self._connected = False
+        self._cache = self._create_cache()
+        # Latest updated_at the change stream reported for each user, so a
+        # read that was in flight during another worker's write isn't cached
+        self._seen_updates = UserCache(maxsize=10_000, ttl=30)
+        # Bumped whenever the change stream (re)opens, and None while it is
+        # down; views are only cached under the generation they were read in
+        self._cache_generation = 0
         self.connect()
 
+        # Redis is shared by every worker, but the in-process cache must be
+        # told about writes made by other workers
+        if isinstance(self._cache, UserCache):
+            self._cache_generation = None
+            threading.Thread(
+                target=self._watch_users, name="users-watch", daemon=True
+            ).start()
+
     def connect(self):
         """Establish connection to MongoDB."""
         if self._connected and self.client is not None:
@@ -36,12 +124,18 @@ class Storage:
             
         try:
             # Create a new client and connect to the server
-            # Use connectTimeoutMS for serverless environments
+            # Use connectTimeoutMS for serverless environments, and keep a
+            # bounded pool of reusable connections so requests fail fast
+            # instead of queueing behind a saturated pool
             self.client = MongoClient(
-                self.mongodb_uri, 
+                self.mongodb_uri,
                 server_api=ServerApi("1"),
                 connectTimeoutMS=5000,
-                serverSelectionTimeoutMS=5000
+                serverSelectionTimeoutMS=5000,
+                maxPoolSize=50,
+                maxIdleTimeMS=60000,
+                waitQueueTimeoutMS=1000,
+                retryWrites=True,
             )
 
             # Send a ping to confirm a successful connection
@@ -52,7 +146,12 @@ class Storage:
             self.db = self.client.todo_app
             self.users_collection = self.db.users
 
-            # Create unique index on username (with check for existing index)
+            # Create unique index on username (with check for existing index).
+            # Task filters such as {"username": ..., "todos.id": ...} resolve
+            # to a single document through this index, so the nested id match
+            # never scans more than one user's arrays; compound multikey
+            # indexes on todos.id / completed.id would only add index
+            # maintenance to every task write.
             try:
                 self.users_collection.create_index("username", unique=True)
             except Exception:
@@ -66,14 +165,192 @@ class Storage:
             self._connected = False
             raise
 
+    def _create_cache(self):
+        """Create the user cache, shared through Redis when REDIS_URL is set."""
+        redis_url = os.getenv("REDIS_URL")
+        if not redis_url:
+            return UserCache(maxsize=10_000, ttl=30)
+
+        import redis
+
+        return RedisUserCache(redis.Redis.from_url(redis_url), ttl=30)
+
+    def _watch_users(self):
+        """
+        Evict cached users changed by any worker, using a change stream.
+
+        The stream is reopened with exponential backoff whenever it fails,
+        resuming after the last change seen. While it is down the cache is
+        bypassed, since writes from other workers would go unnoticed.
+        """
+        pipeline = [
+            {"$match": {"operationType": {"$in": ["update", "replace", "delete"]}}},
+            {
+                "$project": {
+                    "operationType": 1,
+                    "fullDocument.username": 1,
+                    "fullDocument.updated_at": 1,
+                }
+            },
+        ]
+
+        generation = 0
+        resume_token = None
+        delay = 1
+        while True:
+            try:
+                with self.users_collection.watch(
+                    pipeline, full_document="updateLookup", resume_after=resume_token
+                ) as stream:
+                    # Entries cached before the stream opened may have missed
+                    # writes, so start over under a new generation
+                    generation += 1
+                    self._cache_generation = generation
+                    self._cache.clear()
+                    delay = 1
+
+                    for change in stream:
+                        self._evict_changed(change.get("fullDocument"))
+                        resume_token = stream.resume_token
+            except OperationFailure as e:
+                # Also raised when the resume token fell out of the oplog, so
+                # the next attempt starts from the current time
+                print(f"Failed to watch users for cache invalidation: {e}")
+                resume_token = None
+            except PyMongoError as e:
+                print(f"Lost the users change stream, retrying: {e}")
+
+            # Change streams need a replica set; without one the retries keep
+            # failing and every read goes to MongoDB
+            self._cache_generation = None
+            self._cache.clear()
+            time.sleep(delay)
+            delay = min(delay * 2, 60)
+
+    def _evict_changed(self, user: Optional[Dict]):
+        """
+        Evict a user reported by the change stream from the cache.
+
+        Args:
+            user: The changed document's username and updated_at, or None
+                for deleted users
+        """
+        if user is None:
+            # Deleted users can't be mapped back to a username
+            self._cache.clear()
+            return
+
+        # Recorded before evicting, so a read storing its view after this
+        # point sees it and one that stored before is evicted below
+        self._seen_updates.set(user["username"], user.get("updated_at"))
+
+        # Entries already refreshed with the result of this very write share
+        # its updated_at and can stay
+        cached = self._cache.get(user["username"]) or {}
+        if any(
+            view.get("updated_at") != user.get("updated_at")
+            for view in cached.values()
+        ):
+            self._cache.pop(user["username"])
+
+    def _store_view(self, username: str, key: str, view: Dict, generation: int):
+        """
+        Cache a fetched projection, unless it was read before a newer write.
+
+        Args:
+            username: The username
+            key: Name of the projection within the user's cache entry
+            view: The fetched projection
+            generation: The cache generation the view was read in
+        """
+
+        def merge(entry: Optional[Dict]) -> Optional[Dict]:
+            # Checked under the cache lock, so this can't interleave with the
+            # change stream recording a write and evicting the user
+            if generation != self._cache_generation:
+                return None
+            seen_at = self._seen_updates.get(username)
+            if seen_at and (view.get("updated_at") or datetime.min) < seen_at:
+                return None
+            return merge_view(entry, key, view)
+
+        self._cache.update(username, merge)
+
     def close(self):
         """Close MongoDB connection."""
         if self.client:
             self.client.close()
 
+    def _find_cached(
+        self,
+        username: str,
+        key: str,
+        projection: Dict,
+        cacheable: Callable[[Dict], bool] = lambda user: True,
+        updated_at: Optional[datetime] = None,
+    ) -> Optional[Dict]:
+        """
+        Find a projection of a user document, served from the cache when possible.
+
+        Each user has one cache entry holding every projection fetched for
+        them, keyed by name, so evicting the username drops all of them.
+
+        Args:
+            username: The username
+            key: Name of the projection within the user's cache entry
+            projection: The MongoDB projection to fetch on a cache miss
+            cacheable: Decides whether a fetched projection is worth caching
+            updated_at: The user's current updated_at, when the caller has
+                just read it; cached views of any other version are misses
+
+        Returns:
+            The projected document, or None if the user does not exist
+        """
+        generation = self._cache_generation
+        entry = {}
+        if generation is not None:
+            entry = self._cache.get(username) or {}
+        if key in entry and (
+            updated_at is None or entry[key].get("updated_at") == updated_at
+        ):
+            return entry[key]
+
+        user = self.users_collection.find_one({"username": username}, projection)
+        if user is not None and generation is not None and cacheable(user):
+            # A write may have refreshed the entry while this read was in
+            # flight, so merge against the entry as it is now
+            self._store_view(username, key, user, generation)
+        return user
+
+    def _get_user(self, username: str) -> Optional[Dict]:
+        """
+        Get a user's full task lists, served from the cache when possible.
+
+        Args:
+            username: The username
+
+        Returns:
+            Dictionary with the todos and completed arrays, their counts and
+            the updated_at timestamp, or None if the user does not exist
+        """
+        return self._find_cached(
+            username,
+            "lists",
+            {
+                "todos": 1,
+                "completed": 1,
+                "updated_at": 1,
+                "_id": 0,
+                **COUNTS_PROJECTION,
+            },
+        )
+
     def user_exists(self, username: str) -> bool:
         """Check if a user exists in the database."""
-        return self.users_collection.find_one({"username": username}) is not None
+        return (
+            self.users_collection.find_one({"username": username}, {"_id": 1})
+            is not None
+        )
 
     def create_user(self, username: str, password: str) -> bool:
         """
@@ -86,28 +363,31 @@ class Storage:
         Returns:
             True if user was created successfully, False if user already exists
         """
-        if self.user_exists(username):
-            return False
-
         # Hash the password
-        hashed_password = bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt())
+        hashed_password = crypto.hash_password(password)
 
         # Create user document
+        created_at = datetime.utcnow()
         user_doc = {
             "username": username,
             "password": hashed_password,
             "todos": [],
             "completed": [],
-            "created_at": datetime.utcnow(),
+            "next_id": 1,
+            "created_at": created_at,
+            "updated_at": created_at,
         }
 
+        # The unique username index rejects existing users, so no separate
+        # existence check is needed
         try:
             self.users_collection.insert_one(user_doc)
+            self._cache.pop(username)
             return True
         except DuplicateKeyError:
             return False
 
-    def verify_user(self, username: str, password: str) -> bool:
+    def verify_user(self, username: str, password: str) -> Optional[Dict]:
         """
         Verify user credentials.
 
@@ -116,15 +396,30 @@ class Storage:
             password: The plain text password
 
         Returns:
-            True if credentials are valid, False otherwise
+            The user document (with _id and username) if credentials are
+            valid, None otherwise
         """
-        user = self.users_collection.find_one({"username": username})
+        user = self.users_collection.find_one(
+            {"username": username}, {"username": 1, "password": 1}
+        )
 
         if user is None:
-            return False
+            return None
 
         # Verify password
-        return bcrypt.checkpw(password.encode("utf-8"), user["password"])
+        stored_hash = user.pop("password")
+        if not crypto.verify_password(password, stored_hash):
+            return None
+
+        # Upgrade legacy bcrypt hashes and outdated Argon2 parameters now
+        # that the plain text password is known to be correct
+        if crypto.needs_rehash(stored_hash):
+            self.users_collection.update_one(
+                {"_id": user["_id"]},
+                {"$set": {"password": crypto.hash_password(password)}},
+            )
+
+        return user
 
     def get_user_todos(self, username: str) -> List[Dict]:
         """
@@ -136,7 +431,7 @@ class Storage:
         Returns:
             List of todo dictionaries
         """
-        user = self.users_collection.find_one({"username": username})
+        user = self._get_user(username)
         if user:
             return user.get("todos", [])
         return []
@@ -151,11 +446,98 @@ class Storage:
         Returns:
             List of completed task dictionaries
         """
-        user = self.users_collection.find_one({"username": username})
+        user = self._get_user(username)
         if user:
             return user.get("completed", [])
         return []
 
+    def _refresh_cache(self, username: str, first_page: Dict):
+        """
+        Replace a user's cache entry after a write.
+
+        Writes return the updated first page of the main page, which is
+        where the app redirects next, so caching it saves a re-fetch. A
+        concurrent later write that already refreshed the entry wins.
+
+        Args:
+            username: The username
+            first_page: The first page as returned by the write
+        """
+        generation = self._cache_generation
+        if generation is not None:
+            self._store_view(username, page_key(0, PAGE_SIZE), first_page, generation)
+
+    def get_user_view(
+        self,
+        username: str,
+        page: int = 0,
+        page_size: int = PAGE_SIZE,
+        updated_at: Optional[datetime] = None,
+    ) -> Dict:
+        """
+        Get one page of what the main page needs for a user in a single lookup.
+
+        Only the requested page of each task list is fetched; the totals are
+        counted on the server.
+
+        Args:
+            username: The username
+            page: Zero-based page index, applied to both task lists
+            page_size: Number of tasks per list on each page
+            updated_at: The user's updated_at as just read from MongoDB, so
+                a cached page from before another worker's write is skipped
+
+        Returns:
+            Dictionary with todos, completed, stats, updated_at, page and
+            pages (the total number of pages)
+        """
+        # Pages past the end are not cached, so walking ?page=N can't grow
+        # the user's cache entry
+        user = (
+            self._find_cached(
+                username,
+                page_key(page, page_size),
+                page_projection(page, page_size),
+                cacheable=lambda user: page == 0
+                or page * page_size < max(user["todo_count"], user["completed_count"]),
+                updated_at=updated_at,
+            )
+            or {}
+        )
+        stats = {
+            "todo_count": user.get("todo_count", 0),
+            "completed_count": user.get("completed_count", 0),
+        }
+
+        return {
+            "todos": user.get("todos", []),
+            "completed": user.get("completed", []),
+            "stats": stats,
+            "updated_at": user.get("updated_at"),
+            "page": page,
+            "pages": max(1, math.ceil(max(stats.values()) / page_size)),
+        }
+
+    def get_user_updated_at(self, username: str) -> Optional[datetime]:
+        """
+        Get when a user's tasks last changed, without fetching the tasks.
+
+        Always read from MongoDB: it decides whether a client's copy of the
+        page is current, so it can't come from a cache that may miss writes
+        made by other workers.
+
+        Args:
+            username: The username
+
+        Returns:
+            The updated_at timestamp, or None for unknown users and users
+            created before it was tracked
+        """
+        user = self.users_collection.find_one(
+            {"username": username}, {"updated_at": 1, "_id": 0}
+        )
+        return (user or {}).get("updated_at")
+
     def add_todo(self, username: str, task_text: str) -> Dict:
         """
         Add a new todo task for a user.
@@ -167,21 +549,56 @@ class Storage:
         Returns:
             The created task dictionary
         """
-        user = self.users_collection.find_one({"username": username})
+        # Users created before the next_id counter existed get it seeded
+        # from the highest task ID they already have
+        existing_ids = {
+            "$concatArrays": [
+                {"$ifNull": ["$todos.id", []]},
+                {"$ifNull": ["$completed.id", []]},
+            ]
+        }
+        seed_id = {"$add": [{"$ifNull": [{"$max": existing_ids}, 0]}, 1]}
+
+        # Take the next ID and push the task in a single atomic update, so
+        # concurrent adds can never hand out the same ID; timestamps come
+        # from the server clock so every app instance agrees
+        user = self.users_collection.find_one_and_update(
+            {"username": username},
+            [
+                {"$set": {"next_id": {"$ifNull": ["$next_id", seed_id]}}},
+                {
+                    "$set": {
+                        "todos": {
+                            "$concatArrays": [
+                                {"$ifNull": ["$todos", []]},
+                                [
+                                    {
+                                        "id": "$next_id",
+                                        "text": {"$literal": task_text},
+                                        "created_at": "$$NOW",
+                                    }
+                                ],
+                            ]
+                        },
+                        "next_id": {"$add": ["$next_id", 1]},
+                        "updated_at": "$$NOW",
+                    }
+                },
+            ],
+            projection={**page_projection(0, PAGE_SIZE), "next_id": 1},
+            return_document=ReturnDocument.AFTER,
+        )
         if not user:
             return None
 
-        # Get current todos to determine next ID
-        todos = user.get("todos", [])
-        task_id = max([t.get("id", 0) for t in todos], default=0) + 1
-
-        # Create new task
-        new_task = {"id": task_id, "text": task_text, "created_at": datetime.utcnow()}
-
-        # Add to todos array
-        self.users_collection.update_one(
-            {"username": username}, {"$push": {"todos": new_task}}
-        )
+        # $$NOW is fixed for the whole update, so the task was created at
+        # the new updated_at
+        new_task = {
+            "id": user.pop("next_id") - 1,
+            "text": task_text,
+            "created_at": user["updated_at"],
+        }
+        self._refresh_cache(username, user)
 
         return new_task
 
@@ -196,32 +613,69 @@ class Storage:
         Returns:
             True if task was moved successfully, False otherwise
         """
-        user = self.users_collection.find_one({"username": username})
-        if not user:
-            return False
+        return self.bulk_complete(username, [task_id])
 
-        todos = user.get("todos", [])
-        task_to_complete = None
-
-        # Find the task
-        for task in todos:
-            if task.get("id") == task_id:
-                task_to_complete = task
-                break
+    def bulk_complete(self, username: str, task_ids: List[int]) -> bool:
+        """
+        Move several tasks from todos to completed in one update.
 
-        if not task_to_complete:
-            return False
+        Args:
+            username: The username
+            task_ids: The task IDs
 
-        # Remove from todos and add to completed
-        self.users_collection.update_one(
-            {"username": username},
-            {
-                "$pull": {"todos": {"id": task_id}},
-                "$push": {
-                    "completed": {**task_to_complete, "completed_at": datetime.utcnow()}
+        Returns:
+            True if at least one task was moved, False otherwise
+        """
+        is_selected = {"$in": ["$$task.id", task_ids]}
+
+        # Move the tasks to completed and drop them from todos in one atomic
+        # update; the filter only matches if one of them is in todos, and
+        # timestamps come from the server clock
+        user = self.users_collection.find_one_and_update(
+            {"username": username, "todos.id": {"$in": task_ids}},
+            [
+                {
+                    "$set": {
+                        "completed": {
+                            "$concatArrays": [
+                                {"$ifNull": ["$completed", []]},
+                                {
+                                    "$map": {
+                                        "input": {
+                                            "$filter": {
+                                                "input": "$todos",
+                                                "as": "task",
+                                                "cond": is_selected,
+                                            }
+                                        },
+                                        "as": "task",
+                                        "in": {
+                                            "$mergeObjects": [
+                                                "$$task",
+                                                {"completed_at": "$$NOW"},
+                                            ]
+                                        },
+                                    }
+                                },
+                            ]
+                        },
+                        "todos": {
+                            "$filter": {
+                                "input": "$todos",
+                                "as": "task",
+                                "cond": {"$not": [is_selected]},
+                            }
+                        },
+                        "updated_at": "$$NOW",
+                    }
                 },
-            },
+            ],
+            projection=page_projection(0, PAGE_SIZE),
+            return_document=ReturnDocument.AFTER,
         )
+        if user is None:
+            return False
+        self._refresh_cache(username, user)
 
         return True
 
@@ -239,11 +693,36 @@ class Storage:
         Returns:
             True if task was deleted successfully, False otherwise
         """
-        result = self.users_collection.update_one(
-            {"username": username}, {"$pull": {task_type: {"id": task_id}}}
+        return self.bulk_delete(username, [task_id], task_type)
+
+    def bulk_delete(
+        self, username: str, task_ids: List[int], task_type: str = "todos"
+    ) -> bool:
+        """
+        Delete several tasks from todos or completed in one update.
+
+        Args:
+            username: The username
+            task_ids: The task IDs
+            task_type: Either "todos" or "completed"
+
+        Returns:
+            True if at least one task was deleted, False otherwise
+        """
+        user = self.users_collection.find_one_and_update(
+            {"username": username, f"{task_type}.id": {"$in": task_ids}},
+            {
+                "$pull": {task_type: {"id": {"$in": task_ids}}},
+                "$currentDate": {"updated_at": True},
+            },
+            projection=page_projection(0, PAGE_SIZE),
+            return_document=ReturnDocument.AFTER,
         )
+        if user is None:
+            return False
+        self._refresh_cache(username, user)
 
-        return result.modified_count > 0
+        return True
 
     def get_user_stats(self, username: str) -> Dict:
         """
@@ -255,11 +734,50 @@ class Storage:
         Returns:
             Dictionary with todo_count and completed_count
         """
-        user = self.users_collection.find_one({"username": username})
-        if not user:
+        cached = {}
+        if self._cache_generation is not None:
+            cached = self._cache.get(username) or {}
+        for user in cached.values():
+            return {
+                "todo_count": user["todo_count"],
+                "completed_count": user["completed_count"],
+            }
+
+        # Count on the server so only two integers cross the wire
+        stats = self.users_collection.find_one(
+            {"username": username}, {"_id": 0, **COUNTS_PROJECTION}
+        )
+        if not stats:
             return {"todo_count": 0, "completed_count": 0}
 
-        return {
-            "todo_count": len(user.get("todos", [])),
-            "completed_count": len(user.get("completed", [])),
-        }
+        return stats
+
+
+_storage = None
+_storage_lock = threading.Lock()
+
+
+def get_storage() -> Storage:
+    """
+    Get the Storage of the current process, connecting on first use.
+
+    Returns:
+        The process-wide Storage instance
+    """
+    global _storage
+    if _storage is None:
+        with _storage_lock:
+            if _storage is None:
+                _storage = Storage()
+    return _storage
+
+
+def _reset_storage():
+    """Forget the parent's Storage in a forked child; MongoClient is not fork-safe."""
+    global _storage, _storage_lock
+    _storage = None
+    _storage_lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_storage)
@@ -5,43 +5,94 @@ A Flask application for managing personal tasks with user authentication
 and MongoDB storage.
 """
 
-from flask import Flask, render_template, request, redirect, url_for, flash, session
+from flask import Flask, render_template, request, redirect, url_for, flash, session, g
+from jinja2 import FileSystemBytecodeCache
+import hashlib
 import os
-from app.storage import Storage
+from app.storage import PAGE_SIZE, get_storage
 
 app = Flask(__name__)
 
+# Keep compiled templates on disk so fresh processes (e.g. serverless cold
+# starts) skip recompiling them; entries are keyed by the template source,
+# so edits in development are still picked up
+app.jinja_env.bytecode_cache = FileSystemBytecodeCache()
+
 # Load secret key from environment variable
 app.secret_key = os.getenv("SECRET_KEY", "dev-secret-key-change-in-production")
 
-# Initialize storage
-storage = Storage()
+# Keep sessions server-side in Redis when it is configured
+if os.getenv("REDIS_URL"):
+    import redis
+    from flask_session import Session
+
+    app.config["SESSION_TYPE"] = "redis"
+    app.config["SESSION_REDIS"] = redis.Redis.from_url(os.environ["REDIS_URL"])
+    Session(app)
 
 
 @app.before_request
 def require_login():
     """Check if user is logged in before accessing protected routes."""
-    if (
-        request.endpoint not in ["login", "signup", "static"]
-        and "username" not in session
-    ):
+    if request.endpoint in ["login", "signup", "static"]:
+        return
+
+    if "username" not in session:
         return redirect(url_for("login"))
 
+    # Snapshot of the logged-in user taken from the session at login, so
+    # handlers never need a database lookup just to know who is asking
+    g.user = {"username": session["username"], "uid": session.get("uid")}
+
+
+# Checksum of the page markup, so a deploy that changes index.html
+# invalidates pages clients already hold
+with open(os.path.join(app.root_path, app.template_folder, "index.html"), "rb") as f:
+    INDEX_TEMPLATE_VERSION = hashlib.sha1(f.read()).hexdigest()
+
+
+def page_etag(username, page, updated_at):
+    """Build the ETag of a user's task page from when their tasks last changed."""
+    if updated_at is None:
+        return None
+    return hashlib.sha1(
+        f"{INDEX_TEMPLATE_VERSION}:{username}:{page}:{updated_at.isoformat()}".encode()
+    ).hexdigest()
+
+
+def back_to_page(page=None):
+    """Redirect to a page of the task list, by default the one an action came from."""
+    if page is None:
+        page = max(request.args.get("page", 0, type=int), 0)
+    return redirect(url_for("index", page=page or None))
+
 
 @app.route("/")
 def index():
     """Display the main to-do list page."""
-    username = session.get("username")
-    if not username:
-        return redirect(url_for("login"))
-
-    todos = storage.get_user_todos(username)
-    completed = storage.get_user_completed(username)
-    stats = storage.get_user_stats(username)
+    username = g.user["username"]
+    page = max(request.args.get("page", 0, type=int), 0)
+
+    # Answer 304 when the client already has the current page, unless there
+    # are flashed messages that still need to be rendered
+    updated_at = get_storage().get_user_updated_at(username)
+    etag = page_etag(username, page, updated_at)
+    if etag and "_flashes" not in session and request.if_none_match.contains(etag):
+        response = app.response_class(status=304)
+    else:
+        view = get_storage().get_user_view(username, page, updated_at=updated_at)
+        if page >= view["pages"]:
+            return back_to_page(view["pages"] - 1)
+        etag = page_etag(username, page, view["updated_at"])
+        response = app.make_response(
+            render_template("index.html", username=username, **view)
+        )
 
-    return render_template(
-        "index.html", username=username, todos=todos, completed=completed, stats=stats
-    )
+    if etag:
+        response.set_etag(etag)
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
 
 
 @app.route("/login", methods=["GET", "POST"])
@@ -55,8 +106,10 @@ def login():
             flash("Please provide both username and password.", "error")
             return render_template("login.html")
 
-        if storage.verify_user(username, password):
-            session["username"] = username
+        user = get_storage().verify_user(username, password)
+        if user:
+            session["username"] = user["username"]
+            session["uid"] = str(user["_id"])
             flash("Welcome back!", "success")
             return redirect(url_for("index"))
         else:
@@ -85,7 +138,7 @@ def signup():
             flash("Password must be at least 4 characters long.", "error")
             return render_template("signup.html")
 
-        if storage.create_user(username, password):
+        if get_storage().create_user(username, password):
             flash("Account created successfully! Please login.", "success")
             return redirect(url_for("login"))
         else:
@@ -98,6 +151,7 @@ def signup():
 def logout():
     """Handle user logout."""
     session.pop("username", None)
+    session.pop("uid", None)
     flash("You have been logged out.", "info")
     return redirect(url_for("login"))
 
@@ -105,53 +159,86 @@ def logout():
 @app.route("/add", methods=["POST"])
 def add_task():
     """Add a new task to the list."""
-    username = session.get("username")
-    if not username:
-        return redirect(url_for("login"))
+    username = g.user["username"]
 
     task = request.form.get("task")
 
     if task:
-        storage.add_todo(username, task)
+        get_storage().add_todo(username, task)
         flash("Task added successfully!", "success")
-    else:
-        flash("Task cannot be empty!", "error")
 
-    return redirect(url_for("index"))
+        # New tasks go at the end of the list, so show the page they landed on
+        todo_count = get_storage().get_user_stats(username)["todo_count"]
+        return back_to_page(max(todo_count - 1, 0) // PAGE_SIZE)
+
+    flash("Task cannot be empty!", "error")
+    return back_to_page()
 
 
 @app.route("/complete/<int:task_id>")
 def complete_task(task_id):
     """Mark a task as completed."""
-    username = session.get("username")
-    if not username:
-        return redirect(url_for("login"))
+    username = g.user["username"]
 
-    if storage.complete_task(username, task_id):
+    if get_storage().complete_task(username, task_id):
         flash("Task marked as completed!", "success")
     else:
         flash("Task not found.", "error")
 
-    return redirect(url_for("index"))
+    return back_to_page()
 
 
 @app.route("/delete/<task_type>/<int:task_id>")
 def delete_task(task_type, task_id):
     """Delete a task from the list."""
-    username = session.get("username")
-    if not username:
-        return redirect(url_for("login"))
+    username = g.user["username"]
 
     if task_type not in ["todos", "completed"]:
         flash("Invalid task type.", "error")
-        return redirect(url_for("index"))
+        return back_to_page()
 
-    if storage.delete_task(username, task_id, task_type):
+    if get_storage().delete_task(username, task_id, task_type):
         flash("Task deleted successfully!", "success")
     else:
         flash("Task not found.", "error")
 
-    return redirect(url_for("index"))
+    return back_to_page()
+
+
+@app.route("/batch/complete", methods=["POST"])
+def batch_complete():
+    """Mark all selected tasks as completed."""
+    username = g.user["username"]
+    task_ids = request.form.getlist("ids", type=int)
+
+    if not task_ids:
+        flash("No tasks selected.", "error")
+    elif get_storage().bulk_complete(username, task_ids):
+        flash("Selected tasks marked as completed!", "success")
+    else:
+        flash("Tasks not found.", "error")
+
+    return back_to_page()
+
+
+@app.route("/batch/delete/<task_type>", methods=["POST"])
+def batch_delete(task_type):
+    """Delete all selected tasks from the list."""
+    username = g.user["username"]
+    task_ids = request.form.getlist("ids", type=int)
+
+    if task_type not in ["todos", "completed"]:
+        flash("Invalid task type.", "error")
+        return back_to_page()
+
+    if not task_ids:
+        flash("No tasks selected.", "error")
+    elif get_storage().bulk_delete(username, task_ids, task_type):
+        flash("Selected tasks deleted successfully!", "success")
+    else:
+        flash("Tasks not found.", "error")
+
+    return back_to_page()
 
 
 if __name__ == "__main__":